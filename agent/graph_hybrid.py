@@ -1,11 +1,16 @@
 from typing import TypedDict, Annotated, List, Dict, Any, Union
 import operator
+import asyncio
+import hashlib
+import json
+import re
 import dspy
 import sqlite3
+import diskcache
 from langgraph.graph import StateGraph, END
 
 from agent.dspy_signatures import Router, GenerateSQL, SynthesizeAnswer, ExtractConstraints
-from agent.rag.retrieval import Retriever
+from agent.rag.retrieval import Retriever, RetrievedDocs
 from agent.tools.sqlite_tool import SQLiteTool
 
 # --- State Definition ---
@@ -15,7 +20,8 @@ class AgentState(TypedDict):
     
     # Intermediate states
     plan: Dict[str, Any]
-    retrieved_docs: List[Dict[str, Any]]
+    retrieved_docs: RetrievedDocs
+    schema_info: str
     sql_query: str
     sql_result: List[Any]
     sql_error: str
@@ -30,10 +36,68 @@ class AgentState(TypedDict):
     route: str
     retry_count: int
 
+# --- Precompiled Patterns ---
+
+_INT_RE = re.compile(r'\d+')
+_FLOAT_RE = re.compile(r'\d+\.?\d*')
+_FINAL_RE = re.compile(r'"final_answer"\s*:\s*"?([^",}]+)"?')
+_DECISION_RE = re.compile(r'"deci[st]ion"\s*:\s*"(\w+)"')
+_SQL_BLOCK_RE = re.compile(r'```(?:sql)?\s*(SELECT\b.*?)(?:;|```|\[\[|##|$)', re.I | re.S)
+_SQL_FALLBACK_RE = re.compile(r'(SELECT\b.*?)(?:;|```|\[\[|##|$)', re.I | re.S)
+
+# Markdown noise dropped before docs go to the planner: code-fence lines and
+# table separator rows such as |---|:--:|
+_MD_NOISE_RE = re.compile(r'(?m)^[ \t]*(?:```.*|\|?[ \t:|-]*-{3,}[ \t:|-]*)(?:\n|$)')
+
+# Bound planner prefill: only the best chunks, each truncated
+PLANNER_MAX_DOCS = 2
+PLANNER_DOC_CHARS = 800
+
+# Bound synthesizer context for large SQL results
+SYNTH_MAX_ROWS = 20
+
+# Safe placeholder run when SQL generation fails; its result is not an answer
+FALLBACK_SQL = "SELECT 1 as result"
+
+# --- Fast Routing ---
+
+RAG_WORDS = {"return window", "warranty", "policy", "kpi", "formula", "category mapping"}
+SQL_WORDS = {"revenue", "total", "sum", "count", "average", "quantity", "orders in"}
+HYBRID_WORDS = {"campaign", "summer", "winter", "event", "during"}
+
+def _keyword_re(words):
+    return re.compile(r'\b(?:' + '|'.join(re.escape(w) for w in sorted(words)) + r')\b')
+
+_RAG_RE = _keyword_re(RAG_WORDS)
+_SQL_RE = _keyword_re(SQL_WORDS)
+_HYBRID_RE = _keyword_re(HYBRID_WORDS)
+
+def _fast_route(question):
+    """
+    Keyword classifier for the router.
+    Returns 'rag', 'sql' or 'hybrid' when at least two keywords back the
+    decision, otherwise None so the caller falls back to the LLM.
+    """
+    q = question.lower()
+    rag = len(set(_RAG_RE.findall(q)))
+    sql = len(set(_SQL_RE.findall(q)))
+    hybrid = len(set(_HYBRID_RE.findall(q)))
+    
+    if hybrid and sql:
+        decision, score = "hybrid", hybrid + sql
+    elif sql and not rag:
+        decision, score = "sql", sql
+    elif rag and not sql and not hybrid:
+        decision, score = "rag", rag
+    else:
+        return None
+    
+    return decision if score >= 2 else None
+
 # --- Nodes ---
 
 class AgentNodes:
-    def __init__(self, db_path, docs_path):
+    def __init__(self, db_path, docs_path, cache_dir=".cache/dspy"):
         self.sqlite_tool = SQLiteTool(db_path)
         self.retriever = Retriever(docs_path)
         
@@ -42,11 +106,51 @@ class AgentNodes:
         self.sql_generator = dspy.Predict(GenerateSQL)  # Revert to Predict for stability
         self.synthesizer = dspy.ChainOfThought(SynthesizeAnswer)
         self.constraint_extractor = dspy.ChainOfThought(ExtractConstraints)
+        
+        # On-disk memo of predictions, shared across questions and runs
+        self.cache = diskcache.Cache(cache_dir)
+        self.predictors = {
+            "router": self.router,
+            "sql_generator": self.sql_generator,
+            "synthesizer": self.synthesizer,
+            "constraint_extractor": self.constraint_extractor
+        }
+        # Prompt fingerprints: editing a signature's instructions or fields
+        # invalidates its cached predictions
+        self.fingerprints = {
+            name: json.dumps([
+                [p.signature.instructions,
+                 [[field_name, field.json_schema_extra] for field_name, field in p.signature.fields.items()]]
+                for p in module.predictors()
+            ], sort_keys=True, default=str)
+            for name, module in self.predictors.items()
+        }
 
-    def node_router(self, state: AgentState):
+    def cached_call(self, sig_name, **kwargs):
+        """Run a DSPy module, memoized on (model, signature, prompt, inputs)."""
+        model = getattr(dspy.settings.lm, 'model', '')
+        payload = json.dumps([model, sig_name, self.fingerprints[sig_name], sorted(kwargs.items())], default=str)
+        key = hashlib.blake2b(payload.encode('utf-8'), digest_size=16).hexdigest()
+        
+        fields = self.cache.get(key)
+        if fields is not None:
+            return dspy.Prediction(**fields)
+        
+        prediction = self.predictors[sig_name](**kwargs)
+        self.cache.set(key, dict(prediction.items()))
+        return prediction
+
+    async def node_router(self, state: AgentState):
         print(f"--- Router: Analyzing '{state['question']}' ---")
+        
+        # Skip the LLM when the question is clearly lexical
+        decision = _fast_route(state['question'])
+        if decision:
+            print(f"Fast route: {decision}")
+            return {"route": decision}
+        
         try:
-            prediction = self.router(question=state['question'])
+            prediction = await asyncio.to_thread(self.cached_call, "router", question=state['question'])
             decision = prediction.decision.lower().strip()
         except Exception as e:
             print(f"Router Error: {e}")
@@ -54,8 +158,7 @@ class AgentNodes:
             decision = "hybrid"
             error_str = str(e).lower()
             if "decition" in error_str or "decision" in error_str:
-                 import re
-                 match = re.search(r'"deci[st]ion"\s*:\s*"(\w+)"', error_str)
+                 match = _DECISION_RE.search(error_str)
                  if match:
                      decision = match.group(1).lower()
         
@@ -66,18 +169,33 @@ class AgentNodes:
             
         return {"route": decision}
 
-    def node_retriever(self, state: AgentState):
+    async def node_retriever(self, state: AgentState):
         print("--- Retriever: Fetching docs ---")
         results = self.retriever.retrieve(state['question'], k=3)
         return {"retrieved_docs": results}
 
-    def node_planner(self, state: AgentState):
+    async def node_schema_prefetch(self, state: AgentState):
+        print("--- Schema: Prefetching ---")
+        schema_str = self.sqlite_tool.get_schema_detailed()
+        return {"schema_info": schema_str}
+
+    async def node_planner(self, state: AgentState):
         print("--- Planner: Extracting constraints ---")
         
+        # Pure RAG goes straight to the synthesizer, so constraints would be unused
+        if state.get('route') == 'rag':
+            return {"plan": {"constraints": ""}}
+        
         # Extract constraints from retrieved documents if available
-        if state.get('retrieved_docs'):
-            docs_text = "\n".join([doc['content'] for doc in state['retrieved_docs']])
-            prediction = self.constraint_extractor(
+        docs = state.get('retrieved_docs')
+        if docs and docs.contents:
+            # Docs arrive ordered by score, so the head is the best chunks
+            docs_text = "\n".join(
+                _MD_NOISE_RE.sub('', content)[:PLANNER_DOC_CHARS]
+                for content in docs.contents[:PLANNER_MAX_DOCS]
+            )
+            prediction = await asyncio.to_thread(
+                self.cached_call, "constraint_extractor",
                 question=state['question'],
                 documents=docs_text
             )
@@ -87,9 +205,10 @@ class AgentNodes:
         
         return {"plan": {"constraints": "No specific constraints"}}
 
-    def node_nl_sql(self, state: AgentState):
+    async def node_nl_sql(self, state: AgentState):
         print("--- NL SQL: Generating Query ---")
-        schema_str = self.sqlite_tool.get_schema_detailed()
+        # Prefetched alongside the retriever on the hybrid path
+        schema_str = state.get('schema_info') or self.sqlite_tool.get_schema_detailed()
         
         # Get constraints from planner
         constraints = state.get('plan', {}).get('constraints', 'None')
@@ -100,7 +219,8 @@ class AgentNodes:
             q += f" (Previous SQL had error: {state['sql_error']}. Fix it!)"
         
         try:
-            prediction = self.sql_generator(
+            prediction = await asyncio.to_thread(
+                self.cached_call, "sql_generator",
                 question=q,
                 schema_info=schema_str,
                 constraints=str(constraints)
@@ -109,19 +229,10 @@ class AgentNodes:
             # Extract SQL from LLM response - handle multiple formats
             raw_response = str(prediction.sql_query).strip()
             
-            # Remove completion markers
-            raw_response = raw_response.split('[[')[0].split('##')[0].strip()
-            
-            # Extract from markdown blocks
-            if '```sql' in raw_response:
-                sql = raw_response.split('```sql')[1].split('```')[0].strip()
-            elif '```' in raw_response:
-                sql = raw_response.split('```')[1].split('```')[0].strip()
-            else:
-                sql = raw_response
-            
-            # Remove semicolons, comments, and newlines
-            sql = sql.split(';')[0].strip()
+            # Extract from a markdown block, else the first bare SELECT; both stop
+            # at the first semicolon, closing fence or completion marker
+            match = _SQL_BLOCK_RE.search(raw_response) or _SQL_FALLBACK_RE.search(raw_response)
+            sql = match.group(1) if match else raw_response
             sql = ' '.join(sql.split())  # Normalize whitespace
             
             # Basic validation
@@ -133,16 +244,15 @@ class AgentNodes:
         except Exception as e:
             print(f"SQL Generation Error: {e}")
             # Fallback: generate a simple safe query
-            fallback_sql = "SELECT 1 as result"
-            return {"sql_query": fallback_sql, "sql_error": f"Generation failed: {str(e)}"}
+            return {"sql_query": FALLBACK_SQL, "sql_error": f"Generation failed: {str(e)}"}
 
-    def node_executor(self, state: AgentState):
+    async def node_executor(self, state: AgentState):
         print(f"--- Executor: Running SQL ---")
         print(f"Query: {state['sql_query']}")
         
-        result = self.sqlite_tool.execute(state['sql_query'])
+        tag, result = await asyncio.to_thread(self.sqlite_tool.execute, state['sql_query'])
         
-        if isinstance(result, str) and result.startswith("Error"):
+        if tag == "err":
             print(f"   >> SQL Execution Failed: {result}")
             # Increment retry count on error
             current_retries = state.get('retry_count', 0)
@@ -150,27 +260,48 @@ class AgentNodes:
         
         return {"sql_result": result, "sql_error": "", "retry_count": 0}
 
-    def node_synthesizer(self, state: AgentState):
+    async def node_synthesizer(self, state: AgentState):
         print("--- Synthesizer: Formatting Answer ---")
         
         # Compile context
         context_parts = []
         citations = []
         
-        if state.get('retrieved_docs'):
+        docs = state.get('retrieved_docs')
+        if docs and docs.contents:
             context_parts.append("Documentation:")
-            for doc in state['retrieved_docs']:
-                context_parts.append(f"- {doc['content']}")
-                citations.append(doc['id'])
+            for content, doc_id in zip(docs.contents, docs.ids):
+                context_parts.append(f"- {content}")
+                citations.append(doc_id)
                 
-        if state.get('sql_result'):
-            context_parts.append(f"SQL Result: {state['sql_result']}")
+        rows = state.get('sql_result')
+        if rows:
+            sample = json.dumps(rows[:SYNTH_MAX_ROWS], default=str)
+            if len(rows) > SYNTH_MAX_ROWS:
+                context_parts.append(f"SQL Result (first {SYNTH_MAX_ROWS} of {len(rows)} rows): {sample}")
+            else:
+                context_parts.append(f"SQL Result: {sample}")
             citations.append("Orders") # Generic DB citation as per reqs, or derive from query
             
         context_str = "\n".join(context_parts)
         
+        # A single numeric cell already is the answer: skip the LLM
+        fmt = state['format_hint']
+        if (fmt in ('int', 'float') and state.get('sql_query') != FALLBACK_SQL
+                and len(rows or []) == 1 and len(rows[0]) == 1):
+            value = rows[0][0]
+            if isinstance(value, (int, float)):
+                final_ans = int(value) if fmt == 'int' else round(float(value), 2)
+                return {
+                    "final_answer": final_ans,
+                    "explanation": f"Direct value from SQL: {value}",
+                    "confidence": 0.95,
+                    "citations": citations
+                }
+        
         try:
-            prediction = self.synthesizer(
+            prediction = await asyncio.to_thread(
+                self.cached_call, "synthesizer",
                 question=state['question'],
                 context=context_str,
                 format_hint=state['format_hint']
@@ -180,21 +311,13 @@ class AgentNodes:
             final_ans = prediction.final_answer
             
             # Try to convert based on format hint
+            # Extract first number if it's embedded in text
             if state['format_hint'] == 'int':
-                try:
-                    # Extract first number if it's embedded in text
-                    import re
-                    numbers = re.findall(r'\d+', str(final_ans))
-                    final_ans = int(numbers[0]) if numbers else int(final_ans)
-                except:
-                    final_ans = 0
+                match = _INT_RE.search(str(final_ans))
+                final_ans = int(match.group(0)) if match else 0
             elif state['format_hint'] == 'float':
-                try:
-                    import re
-                    numbers = re.findall(r'\d+\.?\d*', str(final_ans))
-                    final_ans = float(numbers[0]) if numbers else float(final_ans)
-                except:
-                    final_ans = 0.0
+                match = _FLOAT_RE.search(str(final_ans))
+                final_ans = float(match.group(0)) if match else 0.0
             
             # Parse confidence
             try:
@@ -215,9 +338,6 @@ class AgentNodes:
         except Exception as e:
             print(f"Synthesizer error: {e}")
             # Fallback: try to parse answer from context or error message
-            import re
-            import json
-            
             # Try to extract from error message if it contains partial JSON
             error_str = str(e)
             final_ans = "N/A"
@@ -227,7 +347,7 @@ class AgentNodes:
             # Attempt to extract fields from partial response
             if "final_answer" in error_str:
                 try:
-                    match = re.search(r'"final_answer"\s*:\s*"?([^",}]+)"?', error_str)
+                    match = _FINAL_RE.search(error_str)
                     if match:
                         final_ans = match.group(1)
                 except:
@@ -261,6 +381,7 @@ def build_graph(db_path, docs_path):
     
     workflow.add_node("router", nodes.node_router)
     workflow.add_node("retriever", nodes.node_retriever)
+    workflow.add_node("schema_prefetch", nodes.node_schema_prefetch)
     workflow.add_node("planner", nodes.node_planner)
     workflow.add_node("nl_sql", nodes.node_nl_sql)
     workflow.add_node("executor", nodes.node_executor)
@@ -270,18 +391,20 @@ def build_graph(db_path, docs_path):
     workflow.set_entry_point("router")
     
     # Conditional Edges from Router
+    def route_from_router(state):
+        if state['route'] == 'sql':
+            return "nl_sql"
+        # Docs and schema are independent: fetch both in parallel
+        return ["retriever", "schema_prefetch"]
+        
     workflow.add_conditional_edges(
         "router",
-        lambda x: x['route'],
-        {
-            "rag": "retriever",
-            "sql": "nl_sql",
-            "hybrid": "retriever" # Start with retriever for hybrid
-        }
+        route_from_router,
+        ["retriever", "schema_prefetch", "nl_sql"]
     )
     
-    # Hybrid flow: Retriever -> Planner -> NL SQL
-    workflow.add_edge("retriever", "planner")
+    # Hybrid flow: (Retriever || Schema) -> Planner -> NL SQL
+    workflow.add_edge(["retriever", "schema_prefetch"], "planner")
     
     # Planner logic
     def planner_router(state):
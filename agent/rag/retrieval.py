@@ -1,13 +1,37 @@
 import os
 import re
-from rank_bm25 import BM25Okapi
+import functools
+from typing import List, NamedTuple
+import numpy as np
+import bm25s
+from concurrent.futures import ThreadPoolExecutor
+
+_CAP_RE = re.compile(r'\b[A-Z][a-zA-Z]+\b')
+_QUOTED_RE = re.compile(r'"([^"]+)"')
+# Zero-width split point before every header line (# or ##)
+_HDR_RE = re.compile(r'(?m)^(?=#)')
+_TOKEN_RE = re.compile(r'\w+')
+
+class RetrievedDocs(NamedTuple):
+    """Top-k chunks as parallel arrays, ordered by descending score."""
+    contents: List[str]
+    ids: List[str]
+    scores: np.ndarray
+
+    @classmethod
+    def empty(cls):
+        return cls([], [], np.empty(0))
 
 class Retriever:
     def __init__(self, docs_dir):
         self.docs_dir = docs_dir
         self.documents = []
         self.doc_ids = []
+        self.docs_lower = []
+        self.headers_lower = []
         self.bm25 = None
+        # Boost vectors per keyword; query keywords repeat heavily across questions
+        self._keyword_boost = functools.lru_cache(maxsize=4096)(self._compute_keyword_boost)
         self._load_documents()
         
     def _load_documents(self):
@@ -16,113 +40,106 @@ class Retriever:
             print(f"Warning: Docs directory {self.docs_dir} not found.")
             return
 
-        for filename in os.listdir(self.docs_dir):
-            if filename.endswith(".md"):
-                file_path = os.path.join(self.docs_dir, filename)
-                base_name = os.path.splitext(filename)[0]
-                
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    content = f.read()
-                    
-                # Simple chunking by headers (##) or just paragraphs if needed
-                # For this requirement, we'll chunk by sections or paragraphs
-                chunks = self._chunk_markdown(content)
-                
-                for i, chunk in enumerate(chunks):
-                    if chunk.strip():
-                        self.documents.append(chunk)
-                        self.doc_ids.append(f"{base_name}::chunk{i}")
+        filenames = sorted(f for f in os.listdir(self.docs_dir) if f.endswith(".md"))
+        
+        # Read and chunk files in parallel; map() keeps the sorted filename order
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as pool:
+            loaded = list(pool.map(self._load_file, filenames))
+        
+        for base_name, chunks in loaded:
+            for i, chunk in enumerate(chunks):
+                if chunk.strip():
+                    self.documents.append(chunk)
+                    self.doc_ids.append(f"{base_name}::chunk{i}")
+
+        # Precompute lowercase text (and header lines) once for keyword boosting
+        self.docs_lower = [doc.lower() for doc in self.documents]
+        self.headers_lower = [
+            '\n'.join(line for line in doc.split('\n') if line.startswith('#'))
+            for doc in self.docs_lower
+        ]
 
         # Initialize BM25
-        tokenized_corpus = [doc.lower().split() for doc in self.documents]
+        tokenized_corpus = [_TOKEN_RE.findall(doc) for doc in self.docs_lower]
         if tokenized_corpus:
-            self.bm25 = BM25Okapi(tokenized_corpus)
+            # Sparse (CSR) index: scoring is a matvec in C rather than a Python loop
+            self.bm25 = bm25s.BM25()
+            self.bm25.index(tokenized_corpus, show_progress=False)
+
+    def _load_file(self, filename):
+        """Read one markdown file and return (base_name, chunks)."""
+        file_path = os.path.join(self.docs_dir, filename)
+        base_name = os.path.splitext(filename)[0]
+        
+        with open(file_path, 'r', encoding='utf-8') as f:
+            content = f.read()
+            
+        # Simple chunking by headers (##) or just paragraphs if needed
+        # For this requirement, we'll chunk by sections or paragraphs
+        return base_name, self._chunk_markdown(content)
 
     def _chunk_markdown(self, content):
         """
         Splits markdown content into semantic chunks.
         Strategy: Split by headers (## or #) and keep content with its header.
         """
-        chunks = []
-        lines = content.split('\n')
-        current_chunk = []
-        
-        for line in lines:
-            # Detect header lines
-            if line.startswith('##') or (line.startswith('#') and not line.startswith('##')):
-                # Save previous chunk if exists
-                if current_chunk:
-                    chunk_text = '\n'.join(current_chunk).strip()
-                    if chunk_text:
-                        chunks.append(chunk_text)
-                # Start new chunk with header
-                current_chunk = [line]
-            else:
-                current_chunk.append(line)
-        
-        # Don't forget the last chunk
-        if current_chunk:
-            chunk_text = '\n'.join(current_chunk).strip()
-            if chunk_text:
-                chunks.append(chunk_text)
-        
-        return chunks
+        return [c.strip() for c in _HDR_RE.split(content) if c.strip()]
+
+    def _compute_keyword_boost(self, kw):
+        """Per-doc boost for a lowercase keyword: +1 body match, +3 header match."""
+        n_docs = len(self.docs_lower)
+        body_mask = np.fromiter((kw in d for d in self.docs_lower), dtype=bool, count=n_docs)
+        # Higher boost for exact matches in headers (lines starting with ##)
+        header_kw = f"# {kw}"
+        header_mask = np.fromiter((header_kw in h for h in self.headers_lower), dtype=bool, count=n_docs)
+        boost = body_mask + 2.0 * (body_mask & header_mask)
+        boost.flags.writeable = False  # shared via the cache
+        return boost
 
     def retrieve(self, query, k=3):
         """
         Retrieve top-k chunks for a given query.
         Uses hybrid scoring: BM25 + exact keyword matching boost.
-        Returns: List of dicts with 'content' and 'id'.
+        Returns: RetrievedDocs with parallel contents, ids and scores.
         """
         if not self.bm25:
-            return []
+            return RetrievedDocs.empty()
             
-        tokenized_query = query.lower().split()
-        bm25_scores = self.bm25.get_scores(tokenized_query)
+        tokenized_query = _TOKEN_RE.findall(query.lower())
+        if not tokenized_query:
+            # bm25s cannot score an empty query (e.g. '' or '!!!')
+            return RetrievedDocs.empty()
+        bm25_scores = self.bm25.get_scores(tokenized_query)  # dense array, one score per doc
         
         # Extract important keywords (capitalized words, quoted terms, numbers)
-        import re
         keywords = []
         # Find capitalized words (likely important terms like "Beverages", "AOV")
-        keywords.extend(re.findall(r'\b[A-Z][a-zA-Z]+\b', query))
+        keywords.extend(_CAP_RE.findall(query))
         # Find quoted terms
-        keywords.extend(re.findall(r'"([^"]+)"', query))
+        keywords.extend(_QUOTED_RE.findall(query))
         # Find important question terms
         important_terms = ['unopened', 'opened', 'perishable', 'non-perishable', 
                           'summer', 'winter', 'aov', 'revenue', 'margin']
         keywords.extend([w for w in query.lower().split() if w in important_terms])
         
         # Combine BM25 with keyword boost
-        hybrid_scores = []
-        for i, bm25_score in enumerate(bm25_scores):
-            doc_lower = self.documents[i].lower()
-            
-            # Boost score if important keywords appear
-            keyword_boost = 0.0
-            for keyword in keywords:
-                if keyword.lower() in doc_lower:
-                    # Higher boost for exact matches in headers (lines starting with ##)
-                    if f"## {keyword.lower()}" in doc_lower or f"# {keyword.lower()}" in doc_lower:
-                        keyword_boost += 3.0
-                    else:
-                        keyword_boost += 1.0
-            
-            hybrid_scores.append(bm25_score + keyword_boost)
+        n_docs = len(self.docs_lower)
+        hybrid_scores = np.asarray(bm25_scores, dtype=np.float64).copy()
+        for keyword in keywords:
+            hybrid_scores += self._keyword_boost(keyword.lower())
         
-        # Get top k indices
-        top_n = sorted(range(len(hybrid_scores)), key=lambda i: hybrid_scores[i], reverse=True)[:k]
+        # Get top k indices (partial select, then order just those k)
+        k = min(k, n_docs)
+        top_n = np.argpartition(hybrid_scores, -k)[-k:]
+        top_n = top_n[np.argsort(hybrid_scores[top_n])[::-1]]
+        # Filter out zero scores to avoid irrelevant noise
+        top_n = top_n[hybrid_scores[top_n] > 0]
         
-        results = []
-        for i in top_n:
-            # Filter out zero scores to avoid irrelevant noise
-            if hybrid_scores[i] > 0:
-                results.append({
-                    "content": self.documents[i],
-                    "id": self.doc_ids[i],
-                    "score": hybrid_scores[i]
-                })
-                
-        return results
+        return RetrievedDocs(
+            contents=[self.documents[i] for i in top_n],
+            ids=[self.doc_ids[i] for i in top_n],
+            scores=hybrid_scores[top_n]
+        )
 
 if __name__ == "__main__":
     # Test Retriever
@@ -135,5 +152,5 @@ if __name__ == "__main__":
     query = "When is the Summer Beverages event?"
     results = retriever.retrieve(query)
     print(f"\nQuery: {query}")
-    for r in results:
-        print(f"- [{r['id']}] {r['content'][:50]}...")
+    for doc_id, content in zip(results.ids, results.contents):
+        print(f"- [{doc_id}] {content[:50]}...")
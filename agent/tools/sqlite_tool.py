@@ -1,9 +1,35 @@
 import sqlite3
+import threading
 
 class SQLiteTool:
     def __init__(self, db_path):
         self.db_path = db_path
+        # One long-lived connection shared by all nodes (guarded by a lock,
+        # since async nodes run tool calls on worker threads); its statement
+        # cache reuses compiled SQL across repeated queries
+        self.conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None,
+                                    cached_statements=256)
+        self.lock = threading.Lock()
+        self._init_pragmas()
         self._init_views()
+        # Schema is static for the run, so build the prompt text once
+        self._schema_detailed = self._compute_schema_detailed()
+        
+    def _init_pragmas(self):
+        """Tune the connection for fast repeated reads."""
+        pragmas = [
+            "PRAGMA journal_mode=WAL;",
+            "PRAGMA synchronous=NORMAL;",
+            "PRAGMA cache_size=-65536;",
+            "PRAGMA temp_store=MEMORY;",
+            "PRAGMA mmap_size=268435456;"
+        ]
+        try:
+            with self.lock:
+                for pragma in pragmas:
+                    self.conn.execute(pragma)
+        except Exception as e:
+            print(f"Warning: Failed to apply pragmas: {e}")
         
     def _init_views(self):
         """Create lowercase compatibility views as required."""
@@ -14,74 +40,65 @@ class SQLiteTool:
             "CREATE VIEW IF NOT EXISTS customers AS SELECT * FROM Customers;"
         ]
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            for view in views:
-                cursor.execute(view)
-            conn.commit()
-            conn.close()
+            with self.lock:
+                for view in views:
+                    self.conn.execute(view)
         except Exception as e:
             print(f"Warning: Failed to initialize views: {e}")
         
     def execute(self, query):
+        """Returns ("ok", rows) on success or ("err", message) on failure."""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            cursor.execute(query)
-            if query.strip().upper().startswith("SELECT") or query.strip().upper().startswith("PRAGMA"):
-                result = cursor.fetchall()
-                conn.close()
-                return result
-            else:
-                conn.commit()
-                conn.close()
-                return "Executed successfully"
+            # Only uppercase the leading keyword, not the whole query
+            is_read = query.lstrip()[:6].upper() in ("SELECT", "PRAGMA")
+            with self.lock:
+                cursor = self.conn.execute(query)
+                if is_read:
+                    return ("ok", cursor.fetchall())
+                else:
+                    return ("ok", [])
         except Exception as e:
-            return f"Error: {str(e)}"
+            return ("err", f"Error: {str(e)}")
     
     def get_schema(self):
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-            tables = cursor.fetchall()
-            schema = {}
-            for table in tables:
-                table_name = table[0]
-                cursor.execute(f"PRAGMA table_info('{table_name}')")
-                columns = cursor.fetchall()
-                schema[table_name] = [col[1] for col in columns]
-            conn.close()
+            with self.lock:
+                tables = self.conn.execute("SELECT name FROM sqlite_master WHERE type='table';").fetchall()
+                schema = {}
+                for table in tables:
+                    table_name = table[0]
+                    columns = self.conn.execute(f"PRAGMA table_info('{table_name}')").fetchall()
+                    schema[table_name] = [col[1] for col in columns]
             return schema
         except Exception as e:
             return f"Error: {str(e)}"
     
     def get_schema_detailed(self):
         """Get detailed schema with types for SQL generation."""
+        return self._schema_detailed
+    
+    def _compute_schema_detailed(self):
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
             # Use lowercase views for simpler SQL generation
             allowed_tables = ['orders', 'order_items', 'products', 'customers', 'categories', 'suppliers']
             
             schema_text = "Database Schema (Use these lowercase views):\n\n"
             
-            for table_name in allowed_tables:
-                try:
-                    cursor.execute(f"PRAGMA table_info('{table_name}')")
-                    columns = cursor.fetchall()
-                    
-                    if columns:
-                        schema_text += f"View: {table_name}\n"
-                        schema_text += "Columns:\n"
-                        for col in columns:
-                            col_name = col[1]
-                            col_type = col[2]
-                            schema_text += f"  - {col_name} ({col_type})\n"
-                        schema_text += "\n"
-                except:
-                    continue
+            with self.lock:
+                for table_name in allowed_tables:
+                    try:
+                        columns = self.conn.execute(f"PRAGMA table_info('{table_name}')").fetchall()
+                        
+                        if columns:
+                            schema_text += f"View: {table_name}\n"
+                            schema_text += "Columns:\n"
+                            for col in columns:
+                                col_name = col[1]
+                                col_type = col[2]
+                                schema_text += f"  - {col_name} ({col_type})\n"
+                            schema_text += "\n"
+                    except:
+                        continue
             
             # Add common patterns
             schema_text += "Common Query Patterns:\n"
@@ -90,7 +107,6 @@ class SQLiteTool:
             schema_text += "- Join pattern: orders o JOIN order_items oi ON o.OrderID = oi.OrderID JOIN products p ON oi.ProductID = p.ProductID\n"
             schema_text += "- Date filtering: WHERE strftime('%Y-%m-%d', o.OrderDate) BETWEEN 'YYYY-MM-DD' AND 'YYYY-MM-DD'\n"
             
-            conn.close()
             return schema_text
         except Exception as e:
             return f"Error: {str(e)}"
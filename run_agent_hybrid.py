@@ -1,8 +1,62 @@
 import argparse
+import asyncio
 import json
 import os
 import dspy
+import litellm
+import orjson
 from agent.graph_hybrid import build_graph
+from agent.rag.retrieval import RetrievedDocs
+
+async def run_question(app, item, semaphore):
+    q_id = item['id']
+    question = item['question']
+    format_hint = item.get('format_hint', "str")
+    
+    # Initial State
+    initial_state = {
+        "question": question,
+        "format_hint": format_hint,
+        "retry_count": 0,
+        "plan": {},
+        "retrieved_docs": RetrievedDocs.empty(),
+        "sql_query": "",
+        "sql_result": [],
+        "sql_error": "",
+        "citations": []
+    }
+    
+    async with semaphore:
+        print(f"\n[ID: {q_id}] Question: {question}")
+        # Run Graph
+        # The result from app.ainvoke is the final state
+        final_state = await app.ainvoke(initial_state)
+    
+    # Construct Output
+    return {
+        "id": q_id,
+        "final_answer": final_state.get('final_answer'),
+        "sql": final_state.get('sql_query', ""),
+        "confidence": final_state.get('confidence', 0.0),
+        "explanation": final_state.get('explanation', ""),
+        "citations": final_state.get('citations', [])
+    }
+
+def get_concurrency(default=8):
+    """Questions in flight, from OLLAMA_NUM_PARALLEL (0/unset = Ollama's auto -> default)."""
+    try:
+        value = int(os.environ.get("OLLAMA_NUM_PARALLEL", "0"))
+    except ValueError:
+        value = 0
+    return max(1, value or default)
+
+async def process_batch(app, items, concurrency, f_out):
+    """Run all questions concurrently, streaming each result to f_out in input order."""
+    semaphore = asyncio.Semaphore(concurrency)
+    tasks = [asyncio.create_task(run_question(app, item, semaphore)) for item in items]
+    for task in tasks:
+        f_out.write(orjson.dumps(await task))
+        f_out.write(b"\n")
 
 def main():
     parser = argparse.ArgumentParser(description="Run the Hybrid AI Agent")
@@ -12,8 +66,11 @@ def main():
 
     # 1. Setup LLM (Ollama)
     print("--- Initializing LLM (phi3.5:3.8b) ---")
-    # Using the dspy.LM unified interface
-    lm = dspy.LM(model='ollama_chat/phi3.5:3.8b', api_base='http://localhost:11434', api_key='')
+    # Using the dspy.LM unified interface; litellm pools connections so concurrent
+    # questions spread across Ollama's parallel slots
+    litellm.drop_params = True
+    lm = dspy.LM(model='ollama_chat/phi3.5:3.8b', api_base='http://localhost:11434', api_key='',
+                 cache=True, num_retries=1)
     dspy.settings.configure(lm=lm)
 
     # 2. Setup Paths
@@ -28,52 +85,18 @@ def main():
     # 4. Process Batch
     print(f"--- Processing {args.batch} -> {args.out} ---")
     
-    results = []
-    
+    items = []
     with open(args.batch, 'r', encoding='utf-8') as f_in:
         for line in f_in:
             if not line.strip(): continue
-            
-            item = json.loads(line)
-            q_id = item['id']
-            question = item['question']
-            format_hint = item.get('format_hint', "str")
-            
-            print(f"\n[ID: {q_id}] Question: {question}")
-            
-            # Initial State
-            initial_state = {
-                "question": question,
-                "format_hint": format_hint,
-                "retry_count": 0,
-                "plan": {},
-                "retrieved_docs": [],
-                "sql_query": "",
-                "sql_result": [],
-                "sql_error": "",
-                "citations": []
-            }
-            
-            # Run Graph
-            # The result from app.invoke is the final state
-            final_state = app.invoke(initial_state)
-            
-            # Construct Output
-            output_item = {
-                "id": q_id,
-                "final_answer": final_state.get('final_answer'),
-                "sql": final_state.get('sql_query', ""),
-                "confidence": final_state.get('confidence', 0.0),
-                "explanation": final_state.get('explanation', ""),
-                "citations": final_state.get('citations', [])
-            }
-            
-            results.append(output_item)
-
-    # 5. Write Output
-    with open(args.out, 'w', encoding='utf-8') as f_out:
-        for item in results:
-            f_out.write(json.dumps(item) + "\n")
+            items.append(json.loads(line))
+    
+    # Keep as many questions in flight as Ollama has parallel slots
+    concurrency = get_concurrency()
+    
+    # 5. Write Output (streamed as answers complete)
+    with open(args.out, 'wb') as f_out:
+        asyncio.run(process_batch(app, items, concurrency, f_out))
             
     print(f"\n--- Done. Results saved to {args.out} ---")
 
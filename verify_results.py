@@ -1,122 +1,281 @@
-import json
+import mmap
 import os
+import pickle
+import re
 import sqlite3
+import sys
+import threading
+import orjson
+from concurrent.futures import ThreadPoolExecutor
 
 db_path = os.path.join("data", "northwind.sqlite")
 
+# Read tuning applied to every ground-truth connection (WAL is set once up front,
+# since switching journal mode needs an exclusive lock)
+TUNING_PRAGMAS = (
+    "PRAGMA synchronous=NORMAL; PRAGMA temp_store=MEMORY; "
+    "PRAGMA cache_size=-65536; PRAGMA mmap_size=268435456;"
+)
+
+# First non-whitespace byte of a line; searched in place on the mmap
+_NON_BLANK_RE = re.compile(rb'\S')
+
+# One connection per worker thread; WAL lets them read concurrently
+_local = threading.local()
+_connections = []
+_connections_lock = threading.Lock()
+
+# Ground-truth SQL per question ID. The hybrid queries read the `joined`
+# temp table built by create_joined_table(), where LineRevenue is precomputed.
+QUERIES = {
+    # Summer 1997 (June) Top Category by Qty
+    "hybrid_top_category_qty_summer_1997": """
+        SELECT CategoryName, SUM(Quantity) as TotalQty
+        FROM joined
+        WHERE OrderDate >= '1997-06-01' AND OrderDate < '1997-07-01'
+        GROUP BY CategoryName
+        ORDER BY TotalQty DESC
+        LIMIT 1;
+    """,
+    # Winter 1997 (Dec) AOV for Dairy/Confections
+    "hybrid_aov_winter_1997": """
+        SELECT (SUM(LineRevenue) / COUNT(DISTINCT OrderID)) as AOV
+        FROM joined
+        WHERE OrderDate >= '1997-12-01' AND OrderDate < '1998-01-01'
+        AND CategoryName IN ('Dairy', 'Confections');
+    """,
+    # Top 3 Products Revenue All-Time
+    "sql_top3_products_by_revenue_alltime": """
+        SELECT p.ProductName, SUM(oi.UnitPrice * oi.Quantity * (1 - oi.Discount)) as Revenue
+        FROM "Order Details" oi
+        JOIN Products p ON oi.ProductID = p.ProductID
+        GROUP BY p.ProductName
+        ORDER BY Revenue DESC
+        LIMIT 3;
+    """,
+    # Summer 1997 (June) Beverages Revenue
+    "hybrid_revenue_beverages_summer_1997": """
+        SELECT SUM(LineRevenue) as Revenue
+        FROM joined
+        WHERE OrderDate >= '1997-06-01' AND OrderDate < '1997-07-01'
+        AND CategoryName = 'Beverages';
+    """,
+}
+
+# Queries that read the `joined` temp table; they share one connection so the
+# join is materialized once
+JOINED_QUERIES = {
+    "hybrid_top_category_qty_summer_1997",
+    "hybrid_aov_winter_1997",
+    "hybrid_revenue_beverages_summer_1997",
+}
+
+# Queries returning several (label, value) rows; the rest return a single row
+MULTI_ROW_QUERIES = {"sql_top3_products_by_revenue_alltime"}
+
+# Answers that come from the docs rather than the database
+SPECIAL = {
+    "rag_policy_beverages_return_days": "14 (From Docs)",
+}
+
+def _iter_jsonl(filepath):
+    """Yield one parsed record per non-blank line of a JSONL file."""
+    if not os.path.exists(filepath) or os.path.getsize(filepath) == 0:
+        return
+    # Map the file and hand byte slices straight to orjson: no utf-8 decode
+    # pass and no per-line str
+    with open(filepath, 'rb') as f, \
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, \
+            memoryview(mm) as mv:
+        size = len(mm)
+        start = 0
+        while start < size:
+            end = mm.find(b'\n', start)
+            if end == -1:
+                end = size
+            # Skip blank lines (empty, whitespace-only, or a lone \r from CRLF files)
+            if _NON_BLANK_RE.search(mm, start, end):
+                yield orjson.loads(mv[start:end])
+            start = end + 1
+
 def load_jsonl(filepath):
-    data = {}
-    if os.path.exists(filepath):
-        with open(filepath, 'r', encoding='utf-8') as f:
-            for line in f:
-                if line.strip():
-                    item = json.loads(line)
-                    data[item['id']] = item
+    return {item['id']: item for item in _iter_jsonl(filepath)}
+
+def load_jsonl_lean(filepath, keys=('id', 'final_answer')):
+    """Like load_jsonl, but keeps only `keys` from each record (drops sql/explanation/etc.)."""
+    return {item['id']: {k: item[k] for k in keys if k in item} for item in _iter_jsonl(filepath)}
+
+def load_jsonl_cached(filepath, keys=('id', 'final_answer')):
+    """
+    load_jsonl_lean with a pickle sidecar (<file>.cache.pkl).
+    The sidecar is reused while the JSONL's mtime/size and the requested keys match.
+    """
+    if not os.path.exists(filepath):
+        return {}
+    st = os.stat(filepath)
+    stamp = (st.st_mtime_ns, st.st_size, tuple(keys))
+    cache_path = filepath + '.cache.pkl'
+
+    try:
+        with open(cache_path, 'rb') as f:
+            cached_stamp, data = pickle.load(f)
+        if cached_stamp == stamp:
+            return data
+    except (OSError, EOFError, pickle.UnpicklingError, ValueError):
+        pass
+
+    data = load_jsonl_lean(filepath, keys)
+    try:
+        with open(cache_path, 'wb') as f:
+            pickle.dump((stamp, data), f, protocol=5)
+    except OSError:
+        pass
     return data
 
-def run_ground_truth_sql(q_id):
+INDEXES = {
+    # Covers the Order Details side of every ground-truth join/aggregate
+    "idx_od_cover": 'CREATE INDEX IF NOT EXISTS idx_od_cover ON "Order Details"(OrderID, ProductID, Quantity, UnitPrice, Discount);',
+    "idx_prod_cat": "CREATE INDEX IF NOT EXISTS idx_prod_cat ON Products(CategoryID, ProductName);",
+}
+
+def create_indexes(conn):
+    """Create the covering indexes once; refresh planner stats only when one was added."""
+    try:
+        placeholders = ", ".join("?" * len(INDEXES))
+        existing = {row[0] for row in conn.execute(
+            f"SELECT name FROM sqlite_master WHERE type='index' AND name IN ({placeholders})",
+            tuple(INDEXES)
+        )}
+        missing = [ddl for name, ddl in INDEXES.items() if name not in existing]
+        if missing:
+            for ddl in missing:
+                conn.execute(ddl)
+            conn.execute("ANALYZE;")
+            conn.commit()
+    except sqlite3.Error as e:
+        print(f"Warning: Failed to create indexes: {e}")
+
+def create_joined_table(cursor):
+    """Materialize the Orders/Order Details/Products/Categories join shared by the hybrid queries."""
+    try:
+        cursor.execute("""
+            CREATE TEMP TABLE IF NOT EXISTS joined AS
+            SELECT o.OrderID, o.OrderDate, oi.UnitPrice, oi.Quantity, oi.Discount,
+                   oi.UnitPrice * oi.Quantity * (1 - oi.Discount) AS LineRevenue,
+                   p.ProductName, c.CategoryName
+            FROM Orders o
+            JOIN "Order Details" oi ON o.OrderID = oi.OrderID
+            JOIN Products p ON oi.ProductID = p.ProductID
+            JOIN Categories c ON p.CategoryID = c.CategoryID;
+        """)
+        # Temp index so the hybrid queries' OrderDate range filters can seek;
+        # it lives with the temp table and never touches the Northwind file
+        cursor.execute("CREATE INDEX IF NOT EXISTS temp.idx_joined_date ON joined(OrderDate);")
+    except sqlite3.Error as e:
+        print(f"Warning: Failed to build joined table: {e}")
+
+def _thread_cursor():
+    """Cursor on this thread's tuned connection, opened on first use."""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(db_path, check_same_thread=False, cached_statements=128)
+        conn.executescript(TUNING_PRAGMAS)
+        _local.conn = conn
+        with _connections_lock:
+            _connections.append(conn)
+    return conn.cursor()
+
+def _run_in_thread(q_ids):
+    """Run a group of ground-truth queries on this thread's connection."""
+    cursor = _thread_cursor()
+    # TEMP tables are private to a connection; only the group that reads
+    # `joined` builds it
+    if any(q_id in JOINED_QUERIES for q_id in q_ids):
+        create_joined_table(cursor)
+    return {q_id: run_ground_truth_sql(cursor, q_id) for q_id in q_ids}
+
+def run_ground_truth_sql(cursor, q_id):
     """Returns the ground truth result for a given question ID by running manual SQL."""
+    if q_id in SPECIAL:
+        return SPECIAL[q_id]
+    sql = QUERIES.get(q_id)
+    if sql is None:
+        return "N/A (Not SQL)"
+
     try:
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        
-        sql = None
-        result = "N/A (Not SQL)"
-        
-        if q_id == "hybrid_top_category_qty_summer_1997":
-            # Summer 1997 (June) Top Category by Qty
-            sql = """
-                SELECT c.CategoryName, SUM(oi.Quantity) as TotalQty
-                FROM Orders o
-                JOIN "Order Details" oi ON o.OrderID = oi.OrderID
-                JOIN Products p ON oi.ProductID = p.ProductID
-                JOIN Categories c ON p.CategoryID = c.CategoryID
-                WHERE strftime('%Y-%m-%d', o.OrderDate) BETWEEN '1997-06-01' AND '1997-06-30'
-                GROUP BY c.CategoryName
-                ORDER BY TotalQty DESC
-                LIMIT 1;
-            """
-        elif q_id == "hybrid_aov_winter_1997":
-            # Winter 1997 (Dec) AOV for Dairy/Confections
-            sql = """
-                SELECT (SUM(oi.UnitPrice * oi.Quantity * (1 - oi.Discount)) / COUNT(DISTINCT o.OrderID)) as AOV
-                FROM Orders o
-                JOIN "Order Details" oi ON o.OrderID = oi.OrderID
-                JOIN Products p ON oi.ProductID = p.ProductID
-                JOIN Categories c ON p.CategoryID = c.CategoryID
-                WHERE strftime('%Y-%m-%d', o.OrderDate) BETWEEN '1997-12-01' AND '1997-12-31'
-                AND c.CategoryName IN ('Dairy', 'Confections');
-            """
-        elif q_id == "sql_top3_products_by_revenue_alltime":
-            # Top 3 Products Revenue All-Time
-            sql = """
-                SELECT p.ProductName, SUM(oi.UnitPrice * oi.Quantity * (1 - oi.Discount)) as Revenue
-                FROM "Order Details" oi
-                JOIN Products p ON oi.ProductID = p.ProductID
-                GROUP BY p.ProductName
-                ORDER BY Revenue DESC
-                LIMIT 3;
-            """
-        elif q_id == "hybrid_revenue_beverages_summer_1997":
-            # Summer 1997 (June) Beverages Revenue
-            sql = """
-                SELECT SUM(oi.UnitPrice * oi.Quantity * (1 - oi.Discount)) as Revenue
-                FROM Orders o
-                JOIN "Order Details" oi ON o.OrderID = oi.OrderID
-                JOIN Products p ON oi.ProductID = p.ProductID
-                JOIN Categories c ON p.CategoryID = c.CategoryID
-                WHERE strftime('%Y-%m-%d', o.OrderDate) BETWEEN '1997-06-01' AND '1997-06-30'
-                AND c.CategoryName = 'Beverages';
-            """
-        elif q_id == "rag_policy_beverages_return_days":
-            return "14 (From Docs)"
-
-        if sql:
-            cursor.execute(sql)
+        cursor.execute(sql)
+        if q_id in MULTI_ROW_QUERIES:
             rows = cursor.fetchall()
-            if not rows:
-                result = "No Data Found"
-            elif rows[0][0] is None:
-                result = "None/Zero"
-            else:
-                # Format complex results
-                if len(rows) > 1:
-                    result = str(rows) # Multiple rows
-                elif len(rows[0]) > 1:
-                    result = str(rows[0]) # Multiple cols
-                else:
-                    result = str(rows[0][0]) # Single value
-                    
-        conn.close()
-        return result
-    except Exception as e:
-        return f"Error: {str(e)}"
+        else:
+            row = cursor.fetchone()
+    except sqlite3.Error as e:
+        return f"SQL Error: {e}"
+
+    if q_id in MULTI_ROW_QUERIES:
+        if not rows:
+            return "No Data Found"
+        return ", ".join(f"{r[0]}=None/Zero" if r[1] is None else f"{r[0]}={r[1]:.2f}" for r in rows)
+    if row is None:
+        return "No Data Found"
+    if row[0] is None:
+        return "None/Zero"
+    return f"{row[0]}: {row[1]}" if len(row) > 1 else str(row[0])
+
+def _trunc(s, n):
+    return s if len(s) <= n else s[:n - 3] + "..."
 
 def verify_results():
     questions_path = "sample_questions_hybrid_eval.jsonl"
     outputs_path = "outputs_hybrid.jsonl"
 
-    questions = load_jsonl(questions_path)
-    outputs = load_jsonl(outputs_path)
+    questions = load_jsonl_cached(questions_path, keys=('id',))
+    outputs = load_jsonl_cached(outputs_path)
+
+    # Docs-based and unknown IDs need no database at all
+    ground_truths = {q_id: SPECIAL.get(q_id, "N/A (Not SQL)") for q_id in questions if q_id not in QUERIES}
+    sql_ids = [q_id for q_id in questions if q_id in QUERIES]
+
+    if sql_ids:
+        # WAL and indexes persist in the database file; set them up before the readers start
+        conn = sqlite3.connect(db_path)
+        conn.execute("PRAGMA journal_mode=WAL;")
+        create_indexes(conn)
+        conn.close()
 
-    print(f"{'ID':<40} | {'Ground Truth (Manual SQL)':<30} | {'Agent Answer'}")
-    print("-" * 100)
+        # The `joined` queries run as one group on a single connection; every
+        # other query is independent and runs in parallel with it
+        joined_ids = [q_id for q_id in sql_ids if q_id in JOINED_QUERIES]
+        groups = [[q_id] for q_id in sql_ids if q_id not in JOINED_QUERIES]
+        if joined_ids:
+            groups.append(joined_ids)
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            for group_results in pool.map(_run_in_thread, groups):
+                ground_truths.update(group_results)
+
+        with _connections_lock:
+            for worker_conn in _connections:
+                worker_conn.close()
+            _connections.clear()
+
+    lines = [
+        f"{'ID':<40} | {'Ground Truth (Manual SQL)':<30} | {'Agent Answer'}",
+        "-" * 100
+    ]
 
     for q_id, q_data in questions.items():
-        ground_truth = str(run_ground_truth_sql(q_id))
+        # Truncate GT for display (run_ground_truth_sql already returns str)
+        ground_truth = _trunc(ground_truths[q_id], 30)
         
         if q_id in outputs:
-            agent_ans = str(outputs[q_id].get('final_answer', 'N/A'))
-            if len(agent_ans) > 40:
-                agent_ans = agent_ans[:37] + "..."
+            # final_answer may be int/float/None, so it still needs str()
+            agent_ans = _trunc(str(outputs[q_id].get('final_answer', 'N/A')), 40)
         else:
             agent_ans = "[NO OUTPUT]"
             
-        # Truncate GT for display
-        if len(ground_truth) > 30:
-            ground_truth = ground_truth[:27] + "..."
-            
-        print(f"{q_id:<40} | {ground_truth:<30} | {agent_ans}")
+        lines.append(f"{q_id:<40} | {ground_truth:<30} | {agent_ans}")
+
+    # Emit the whole table in one write
+    sys.stdout.write("\n".join(lines) + "\n")
 
 if __name__ == "__main__":
     verify_results()